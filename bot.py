@@ -12,21 +12,34 @@ import subprocess
 import shutil
 import logging
 import re
+import json
+import urllib.parse
+import functools
+import tempfile
+import sqlite3
+import socket
+from contextlib import closing
 from pathlib import Path
 from typing import Optional, Dict, Tuple
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+import threading
 import time
 
 try:
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+    from telegram.error import BadRequest
     from telegram.ext import (
         Application, CommandHandler, MessageHandler, 
         filters, ContextTypes, CallbackQueryHandler
     )
     from pymediainfo import MediaInfo
+    import httpx
     import numpy as np
     from scipy.io import wavfile
-    from scipy import signal
+    from scipy import fft as sp_fft
 except ImportError:
     print("❌ Missing dependencies!")
     print("Run: pip install python-telegram-bot pymediainfo numpy scipy")
@@ -46,6 +59,30 @@ TEMP_DIR = Path("./temp")
 WORK_DIR.mkdir(exist_ok=True)
 TEMP_DIR.mkdir(exist_ok=True)
 
+# Local Bot API server (telegram-bot-api --local): 2 GB uploads, and the
+# files it already wrote to disk are used in place instead of copied
+LOCAL_BOT_API = None         # e.g. "http://localhost:8081"
+UPLOAD_PROGRESS_INTERVAL = 3 # seconds between upload progress updates
+
+# Analysis process pool: 0 runs correlation in the calling thread
+ANALYSIS_PROCESSES = 2             # start + end windows correlate in parallel
+ANALYSIS_WARMUP_SECONDS = (270,)   # window lengths to pre-plan FFTs for
+SAMPLE_RATE = 48000
+
+# Window selection: low-rate scan of the reference to avoid silence/logos
+SCAN_RATE = 4000             # Hz, mono
+SCAN_CACHE_SIZE = 64         # files kept in the activity cache
+SCAN_TIMEOUT = (60, 0.1)     # (base s, s per s of media); past it, default windows
+PROBE_CACHE_SIZE = 256       # files kept in the media info cache
+
+# Queue mode: set QUEUE_DB to a SQLite path to make the bot only queue
+# jobs; run `python bot.py worker` processes to handle them. Single host
+# only: SQLite (WAL) locking does not work on network filesystems.
+QUEUE_DB = None              # e.g. Path("./queue.db")
+QUEUE_POLL_INTERVAL = 2      # seconds between queue checks
+QUEUE_STALE_AFTER = 3600     # re-queue running jobs silent for this many seconds
+QUEUE_HEARTBEAT = 60         # seconds between "still running" touches
+
 # Logging
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -56,6 +93,8 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+# httpx logs every request URL at INFO; Bot API URLs contain the token
+logging.getLogger('httpx').setLevel(logging.WARNING)
 
 # ============================================================================
 # DOWNLOAD MANAGER (Multi-protocol support)
@@ -125,6 +164,15 @@ class DownloadManager:
             logger.error(f"Download error: {e}")
             return False
     
+    async def resolve(self, source: Tuple, output_path: Path) -> Optional[Path]:
+        """Return a local path for a ('link', url) or ('file', path, name) entry"""
+        source_type, source_data = source[0], source[1]
+        if source_type == 'link':
+            if not await self.download(source_data, output_path):
+                return None
+            return output_path
+        return Path(source_data)
+    
     async def _download_aria2c(self, url: str, output: Path, callback) -> bool:
         """Download using aria2c (fast, resumable)"""
         cmd = [
@@ -197,6 +245,216 @@ class DownloadManager:
             else:
                 break
 
+# ============================================================================
+# UPLOAD MANAGER (Telegram file ingestion)
+# ============================================================================
+
+def redact_token(text: str) -> str:
+    """Mask the bot token in Bot API URLs (…/bot<TOKEN>/…)"""
+    return re.sub(r'/bot[^/\s]+', '/bot<token>', text)
+
+
+class UploadManager:
+    """Fetches Telegram uploads: in place (local Bot API) or streamed"""
+    
+    @staticmethod
+    def describe_error(error: Exception) -> str:
+        """Short, user-safe reason (never the URL)"""
+        if isinstance(error, httpx.HTTPStatusError):
+            return f"HTTP {error.response.status_code}"
+        if isinstance(error, BadRequest):
+            return error.message
+        return error.__class__.__name__
+    
+    @staticmethod
+    def is_permanent(error: Exception) -> bool:
+        """True when resending the same file cannot help (e.g. over the 20 MB limit)"""
+        if isinstance(error, BadRequest):
+            return 'too big' in error.message.lower()
+        return isinstance(error, FileNotFoundError)
+    
+    def __init__(self, local_api: Optional[str] = LOCAL_BOT_API):
+        self.local_api = local_api
+    
+    async def ingest(self, file, output_path: Path, progress_callback=None) -> Path:
+        """
+        Return a local path for a telegram.File
+        A local Bot API server hands out absolute on-disk paths; those are
+        used directly. Everything else is streamed to output_path.
+        """
+        if self.local_api and file.file_path:
+            local = Path(file.file_path)
+            if local.is_absolute():
+                if local.exists():
+                    logger.info(f"Using local Bot API file in place: {local}")
+                    return local
+                raise FileNotFoundError(
+                    f"{local} is not visible here (is the Bot API server on another host?)"
+                )
+        
+        if file.file_path and file.file_path.startswith(('http://', 'https://')):
+            await self._stream(file.file_path, output_path, file.file_size or 0, progress_callback)
+        else:
+            await file.download_to_drive(output_path)
+        return output_path
+    
+    async def _stream(self, url: str, output: Path, total: int, callback):
+        """Chunked HTTP download with throttled progress"""
+        timeout = httpx.Timeout(30, read=300)
+        async with httpx.AsyncClient(timeout=timeout, follow_redirects=True) as client:
+            async with client.stream('GET', url) as response:
+                response.raise_for_status()
+                total = int(response.headers.get('content-length', 0)) or total
+                done = 0
+                last_report = time.time()
+                
+                with open(output, 'wb') as fh:
+                    async for chunk in response.aiter_bytes(1024 * 1024):
+                        fh.write(chunk)
+                        done += len(chunk)
+                        if callback and time.time() - last_report >= UPLOAD_PROGRESS_INTERVAL:
+                            last_report = time.time()
+                            await callback(done, total)
+
+# ============================================================================
+# ANALYSIS POOL (Warm worker processes)
+# ============================================================================
+
+def fft_correlate(ref_data: np.ndarray, new_data: np.ndarray) -> int:
+    """Lag (in samples) of new_data relative to ref_data via padded FFT"""
+    ref_data = ref_data.astype(np.float64) - np.mean(ref_data)
+    new_data = new_data.astype(np.float64) - np.mean(new_data)
+    
+    # Pad to a fast FFT length (arbitrary sample counts can be very slow)
+    n = sp_fft.next_fast_len(len(ref_data) + len(new_data) - 1, real=True)
+    spectrum = sp_fft.rfft(new_data, n) * np.conj(sp_fft.rfft(ref_data, n))
+    circular = sp_fft.irfft(spectrum, n)
+    
+    # Unwrap to 'full' mode ordering: lags -(len(ref)-1) .. len(new)-1
+    corr = np.concatenate((circular[n - (len(ref_data) - 1):], circular[:len(new_data)]))
+    return int(corr.argmax()) - (len(ref_data) - 1)
+
+
+def _warm_analysis_worker(warmup_seconds: Tuple[int, ...]):
+    """Pool initializer: build FFT plans for the usual window sizes"""
+    for seconds in warmup_seconds:
+        samples = int(seconds * SAMPLE_RATE)
+        # One transform at the padded length plans both rfft and irfft
+        # without allocating the full correlation buffers
+        sp_fft.rfft(np.zeros(sp_fft.next_fast_len(2 * samples - 1, real=True)))
+
+
+def _correlate_shared(ref_name: str, ref_len: int, new_name: str, new_len: int,
+                      dtype: str) -> int:
+    """Pool task: correlate PCM buffers living in shared memory"""
+    ref_shm = shared_memory.SharedMemory(name=ref_name)
+    new_shm = shared_memory.SharedMemory(name=new_name)
+    try:
+        return fft_correlate(
+            np.ndarray((ref_len,), dtype=dtype, buffer=ref_shm.buf),
+            np.ndarray((new_len,), dtype=dtype, buffer=new_shm.buf)
+        )
+    finally:
+        ref_shm.close()
+        new_shm.close()
+
+
+class AnalysisPool:
+    """Persistent, pre-warmed process pool for correlation (no GIL contention)"""
+    
+    def __init__(self, processes: int = ANALYSIS_PROCESSES,
+                 warmup_seconds: Tuple[int, ...] = ANALYSIS_WARMUP_SECONDS):
+        if os.name == 'posix':
+            # Children must share our resource tracker, or each starts its
+            # own and reports the blocks we unlink as leaked
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+        self.processes = processes
+        self.warmup_seconds = tuple(warmup_seconds)
+        self.lock = threading.Lock()
+        self.executor = self._start()
+        logger.info(f"Analysis pool: {processes} process(es)")
+    
+    def _start(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_warm_analysis_worker,
+            initargs=(self.warmup_seconds,)
+        )
+        # Start (and warm) every process now instead of on the first job
+        for _ in range(self.processes):
+            executor.submit(int)
+        return executor
+    
+    def _restart(self, broken: ProcessPoolExecutor):
+        """Replace a broken executor (once, however many callers saw it break)"""
+        with self.lock:
+            if self.executor is broken:
+                logger.warning("Analysis pool broke (a process died), restarting it")
+                broken.shutdown(wait=False)
+                self.executor = self._start()
+    
+    def _share(self, data: np.ndarray) -> shared_memory.SharedMemory:
+        shm = shared_memory.SharedMemory(create=True, size=max(1, data.nbytes))
+        np.ndarray(data.shape, dtype=data.dtype, buffer=shm.buf)[:] = data
+        return shm
+    
+    def correlate_many(self, pairs: list) -> list:
+        """
+        Run fft_correlate for every (ref, new) pair concurrently in the pool,
+        passing PCM via shared memory. Returns lags (or exceptions) in order.
+        """
+        blocks = []
+        tasks = []
+        try:
+            for ref_data, new_data in pairs:
+                ref_data = np.ascontiguousarray(ref_data)
+                new_data = np.ascontiguousarray(new_data, dtype=ref_data.dtype)
+                ref_shm = self._share(ref_data)
+                blocks.append(ref_shm)
+                new_shm = self._share(new_data)
+                blocks.append(new_shm)
+                tasks.append((ref_shm.name, len(ref_data), new_shm.name, len(new_data),
+                              ref_data.dtype.str))
+            
+            # A dead process breaks the whole pool: restart it and retry once
+            results = self._run(tasks)
+            if any(isinstance(result, BrokenProcessPool) for result in results):
+                results = self._run(tasks)
+            return results
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+    
+    def _run(self, tasks: list) -> list:
+        """Submit every task to the current executor; returns results or exceptions"""
+        executor = self.executor
+        futures = []
+        try:
+            try:
+                for task in tasks:
+                    futures.append(executor.submit(_correlate_shared, *task))
+            except BrokenProcessPool as e:
+                self._restart(executor)
+                return [e] * len(tasks)
+            
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append(e)
+            if any(isinstance(result, BrokenProcessPool) for result in results):
+                self._restart(executor)
+            return results
+        finally:
+            for future in futures:
+                future.cancel()
+    
+    def shutdown(self):
+        self.executor.shutdown()
+
 # ============================================================================
 # SYNC ENGINE (Your proven algorithm)
 # ============================================================================
@@ -204,22 +462,61 @@ class DownloadManager:
 class SyncEngine:
     """Battle-tested sync detection"""
     
-    def __init__(self):
-        self.temp = TEMP_DIR
+    def __init__(self, temp_dir: Path = TEMP_DIR, pool: Optional[AnalysisPool] = None):
+        self.temp = temp_dir
+        self.pool = pool
+        self.activity_cache = {}
+        self.activity_lock = threading.Lock()
+        self.probe_cache = {}
+        self.probe_lock = threading.Lock()
+        self.probe_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='probe')
+        self.temp.mkdir(parents=True, exist_ok=True)
     
-    def get_media_info(self, file_path: Path) -> Dict:
-        """Extract comprehensive media info"""
+    def get_media_info(self, file_path: Path, name: Optional[str] = None) -> Dict:
+        """Extract comprehensive media info (cached per file)"""
         try:
-            mi = MediaInfo.parse(str(file_path))
-            
-            info = {
-                'filename': file_path.name,
-                'size_gb': file_path.stat().st_size / (1024**3),
+            stat = file_path.stat()
+        except OSError as e:
+            logger.error(f"MediaInfo error: {e}")
+            return {
+                'filename': name or file_path.name,
+                'size_gb': 0,
                 'duration': 0,
                 'fps': 'N/A',
                 'codec': 'Unknown',
                 'internal_delay': 0
             }
+        
+        key = (str(file_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        with self.probe_lock:
+            cached = self.probe_cache.get(key)
+        if cached is not None:
+            return dict(cached, filename=name or file_path.name)
+        
+        info, missing = self._probe_mediainfo(file_path, stat.st_size)
+        if missing:
+            self._probe_ffprobe(file_path, info, missing)
+        
+        # Incomplete probes are not cached so a retry probes again
+        if info['duration']:
+            with self.probe_lock:
+                if len(self.probe_cache) >= PROBE_CACHE_SIZE:
+                    self.probe_cache.pop(next(iter(self.probe_cache)))
+                self.probe_cache[key] = info
+        return dict(info, filename=name or file_path.name)
+    
+    def _probe_mediainfo(self, file_path: Path, size: int) -> Tuple[Dict, set]:
+        """MediaInfo pass; returns (info, fields still missing)"""
+        info = {
+            'filename': file_path.name,
+            'size_gb': size / (1024**3),
+            'duration': 0,
+            'fps': 'N/A',
+            'codec': 'Unknown',
+            'internal_delay': 0
+        }
+        try:
+            mi = MediaInfo.parse(str(file_path))
             
             if mi.general_tracks:
                 gen = mi.general_tracks[0]
@@ -244,19 +541,153 @@ class SyncEngine:
                 elif aud.delay is not None:
                     delay_str = str(aud.delay).replace('ms', '').strip()
                     info['internal_delay'] = int(float(delay_str))
-            
-            return info
         
         except Exception as e:
             logger.error(f"MediaInfo error: {e}")
-            return {
-                'filename': file_path.name,
-                'size_gb': 0,
-                'duration': 0,
-                'fps': 'N/A',
-                'codec': 'Unknown',
-                'internal_delay': 0
-            }
+            return info, {'duration', 'delay'}
+        
+        # No delay field from MediaInfo means 0; only the duration is refetched
+        return info, set() if info['duration'] else {'duration'}
+    
+    def _probe_ffprobe(self, file_path: Path, info: Dict, missing: set):
+        """Fill missing duration/delay (and labels) from ffprobe"""
+        if not shutil.which('ffprobe'):
+            logger.warning(f"ffprobe not found, {file_path.name} probe incomplete")
+            return
+        
+        cmd = [
+            'ffprobe', '-v', 'error',
+            '-show_entries',
+            'format=duration:stream=codec_type,codec_name,start_time,duration,avg_frame_rate,sample_rate',
+            '-of', 'json', str(file_path)
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+            data = json.loads(result.stdout or '{}')
+        except Exception as e:
+            logger.error(f"ffprobe error: {e}")
+            return
+        
+        streams = data.get('streams', [])
+        video = next((st for st in streams if st.get('codec_type') == 'video'), None)
+        audio = next((st for st in streams if st.get('codec_type') == 'audio'), None)
+        
+        if 'duration' in missing:
+            for source in (data.get('format', {}), audio or {}, video or {}):
+                if source.get('duration') not in (None, 'N/A'):
+                    info['duration'] = float(source['duration'])
+                    break
+        
+        if 'delay' in missing and video and audio:
+            try:
+                delta = float(audio['start_time']) - float(video['start_time'])
+                info['internal_delay'] = int(round(delta * 1000))
+            except (KeyError, ValueError):
+                pass
+        
+        if info['fps'] == 'N/A':
+            if audio and audio.get('sample_rate'):
+                info['fps'] = audio['sample_rate']
+            elif video and video.get('avg_frame_rate'):
+                num, _, den = video['avg_frame_rate'].partition('/')
+                try:
+                    info['fps'] = f"{int(num) / int(den or 1):.3f}"
+                except (ValueError, ZeroDivisionError):
+                    pass
+        
+        if info['codec'] == 'Unknown':
+            info['codec'] = (audio or video or {}).get('codec_name', 'Unknown')
+    
+    def scan_activity(self, file: Path, stream: str = "0:a:0",
+                      duration: float = 0) -> Optional[np.ndarray]:
+        """Per-second activity score (energy x spectral change), cached per file"""
+        stat = file.stat()
+        key = (str(file.resolve()), stat.st_size, stat.st_mtime_ns, stream)
+        with self.activity_lock:
+            cached = self.activity_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        cmd = [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error',
+            '-i', str(file), '-map', stream,
+            '-vn', '-ac', '1', '-ar', str(SCAN_RATE), '-f', 's16le', '-'
+        ]
+        timeout = SCAN_TIMEOUT[0] + duration * SCAN_TIMEOUT[1]
+        try:
+            result = subprocess.run(cmd, capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Activity scan of {file.name} timed out after {timeout:.0f}s")
+            return None
+        pcm = np.frombuffer(result.stdout, dtype=np.int16)
+        seconds = len(pcm) // SCAN_RATE
+        if result.returncode != 0 or seconds < 2:
+            logger.warning(f"Activity scan failed for {file.name}")
+            return None
+        
+        blocks = pcm[:seconds * SCAN_RATE].reshape(seconds, SCAN_RATE).astype(np.float32)
+        
+        # Loudness (dB), floored so silence scores zero
+        rms = np.sqrt(np.mean(blocks ** 2, axis=1))
+        loudness = np.clip(20 * np.log10(rms + 1e-9) + 60, 0, None)
+        
+        # Spectral flux: how much the spectrum changes second to second.
+        # Static content (tones, logo stings, room noise) scores low.
+        spectrum = np.abs(sp_fft.rfft(blocks * np.hanning(SCAN_RATE), axis=1))
+        spectrum /= spectrum.sum(axis=1, keepdims=True) + 1e-9
+        flux = np.concatenate(([0.0], 0.5 * np.sum(np.abs(np.diff(spectrum, axis=0)), axis=1)))
+        
+        activity = loudness * flux
+        
+        with self.activity_lock:
+            if len(self.activity_cache) >= SCAN_CACHE_SIZE:
+                self.activity_cache.pop(next(iter(self.activity_cache)))
+            self.activity_cache[key] = activity
+        return activity
+    
+    def select_windows(self, file: Path, stream: str, min_duration: float,
+                       sample_dur: int, duration: float = 0) -> Tuple[float, Optional[float]]:
+        """
+        Pick the most information-rich start/end windows
+        Returns (start_pos, end_pos); end_pos is None if the file is too
+        short for two windows. Falls back to the fixed head/tail positions.
+        duration is the file's own length (bounds the scan time).
+        """
+        has_end = min_duration > sample_dur * 2 + 10
+        default = (0.0, float(min_duration - sample_dur - 5) if has_end else None)
+        
+        try:
+            activity = self.scan_activity(file, stream, duration or min_duration)
+        except Exception as e:
+            logger.warning(f"Activity scan error: {e}")
+            activity = None
+        
+        last_start = int(min_duration - sample_dur - 5)
+        if activity is None or last_start <= 0:
+            return default
+        
+        # Mean activity of every window [t, t + sample_dur)
+        activity = activity[:int(min_duration)]
+        cumsum = np.concatenate(([0.0], np.cumsum(activity)))
+        starts = np.arange(0, min(last_start, len(activity) - sample_dur) + 1)
+        if len(starts) == 0:
+            return default
+        scores = cumsum[starts + sample_dur] - cumsum[starts]
+        
+        if not has_end:
+            return float(starts[scores.argmax()]), None
+        
+        # One window from each half so drift is still measured across the file
+        half = int(min_duration / 2)
+        head = scores[:max(1, half - sample_dur + 1)]
+        tail_from = min(half, len(scores) - 1)
+        tail = scores[tail_from:]
+        start_pos = float(head.argmax())
+        end_pos = float(tail_from + tail.argmax())
+        
+        if end_pos - start_pos < sample_dur:
+            return default
+        return start_pos, end_pos
     
     def extract_sample(self, file: Path, start: float, duration: float, 
                       output: Path, stream: str = "0:a:0") -> bool:
@@ -265,91 +696,131 @@ class SyncEngine:
             'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
             '-ss', str(start), '-i', str(file),
             '-map', stream, '-t', str(duration),
-            '-vn', '-acodec', 'pcm_s16le', '-ar', '48000', '-ac', '2',
+            '-vn', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-ac', '2',
             str(output)
         ]
         
         result = subprocess.run(cmd, capture_output=True)
         return output.exists() and output.stat().st_size > 1000
     
-    def correlate(self, ref_wav: Path, new_wav: Path) -> Optional[float]:
-        """Calculate delay via cross-correlation"""
-        try:
-            ref_rate, ref_data = wavfile.read(ref_wav)
-            new_rate, new_data = wavfile.read(new_wav)
-            
-            if ref_rate != new_rate:
-                return None
-            
-            # Mono conversion
-            if ref_data.ndim > 1:
-                ref_data = ref_data[:, 0]
-            if new_data.ndim > 1:
-                new_data = new_data[:, 0]
-            
-            # Normalize
-            ref_data = ref_data.astype(float) - np.mean(ref_data)
-            new_data = new_data.astype(float) - np.mean(new_data)
-            
-            # Correlate
-            corr = signal.correlate(new_data, ref_data, mode='full')
-            lag = corr.argmax() - (len(ref_data) - 1)
-            
-            return (lag / ref_rate) * 1000
+    def _load_pcm(self, ref_wav: Path, new_wav: Path) -> Optional[Tuple[int, np.ndarray, np.ndarray]]:
+        """Read a sample pair as mono PCM; None if the rates differ"""
+        ref_rate, ref_data = wavfile.read(ref_wav)
+        new_rate, new_data = wavfile.read(new_wav)
         
-        except Exception as e:
-            logger.error(f"Correlation error: {e}")
+        if ref_rate != new_rate:
             return None
+        
+        # Mono conversion
+        if ref_data.ndim > 1:
+            ref_data = ref_data[:, 0]
+        if new_data.ndim > 1:
+            new_data = new_data[:, 0]
+        
+        return ref_rate, ref_data, new_data
+    
+    def correlate_many(self, wav_pairs: list) -> list:
+        """Delays (ms) for several (ref_wav, new_wav) pairs, run concurrently on the pool"""
+        delays = [None] * len(wav_pairs)
+        loaded = []
+        for index, (ref_wav, new_wav) in enumerate(wav_pairs):
+            try:
+                pcm = self._load_pcm(ref_wav, new_wav)
+                if pcm is not None:
+                    loaded.append((index, pcm))
+            except Exception as e:
+                logger.error(f"Correlation error: {e}")
+        
+        # Correlate
+        if self.pool:
+            lags = self.pool.correlate_many([(ref, new) for _, (_, ref, new) in loaded])
+        else:
+            lags = []
+            for _, (_, ref, new) in loaded:
+                try:
+                    lags.append(fft_correlate(ref, new))
+                except Exception as e:
+                    lags.append(e)
+        
+        for (index, (rate, _, _)), lag in zip(loaded, lags):
+            if isinstance(lag, Exception):
+                logger.error(f"Correlation error: {lag}")
+            else:
+                delays[index] = (lag / rate) * 1000
+        return delays
+    
+    def correlate(self, ref_wav: Path, new_wav: Path) -> Optional[float]:
+        """Calculate delay via cross-correlation"""
+        return self.correlate_many([(ref_wav, new_wav)])[0]
     
     def analyze(self, ref_file: Path, new_file: Path, 
                ref_stream: str = "0:a:0", 
-               new_stream: str = "0:a:0") -> Dict:
-        """Complete analysis"""
+               new_stream: str = "0:a:0",
+               ref_name: Optional[str] = None,
+               new_name: Optional[str] = None) -> Dict:
+        """Complete analysis (names override the on-disk ones in the report)"""
         start_time = time.time()
+        work = Path(tempfile.mkdtemp(dir=self.temp))
         
         try:
-            # Get info
-            ref_info = self.get_media_info(ref_file)
-            new_info = self.get_media_info(new_file)
+            # Get info (both probes run concurrently)
+            probe_start = time.time()
+            ref_probe = self.probe_executor.submit(self.get_media_info, ref_file, ref_name)
+            new_probe = self.probe_executor.submit(self.get_media_info, new_file, new_name)
+            ref_info = ref_probe.result()
+            new_info = new_probe.result()
+            probe_time = time.time() - probe_start
+            
+            for info in (ref_info, new_info):
+                if not info['duration']:
+                    raise ValueError(f"Could not determine duration of {info['filename']}")
             
             # Sample duration
             min_duration = min(ref_info['duration'], new_info['duration'])
             sample_dur = 270 if min_duration > 600 else max(30, int(min_duration / 3))
             
+            # Pick information-rich windows (cached per reference file)
+            start_pos, end_pos = self.select_windows(ref_file, ref_stream, min_duration, sample_dur,
+                                                 ref_info['duration'])
+            
             # Extract start samples
-            logger.info("Extracting start samples...")
-            ref_start = self.temp / "ref_start.wav"
-            new_start = self.temp / "new_start.wav"
+            logger.info(f"Extracting start samples at {start_pos:.0f}s...")
+            ref_start = work / "ref_start.wav"
+            new_start = work / "new_start.wav"
             
-            if not self.extract_sample(ref_file, 0, sample_dur, ref_start, ref_stream):
+            if not self.extract_sample(ref_file, start_pos, sample_dur, ref_start, ref_stream):
                 raise ValueError("Failed to extract reference sample")
             
-            if not self.extract_sample(new_file, 0, sample_dur, new_start, new_stream):
+            if not self.extract_sample(new_file, start_pos, sample_dur, new_start, new_stream):
                 raise ValueError("Failed to extract audio sample")
             
-            # Calculate start delay
-            delay_start = self.correlate(ref_start, new_start)
-            if delay_start is None:
-                raise ValueError("Correlation failed")
-            
             # Extract end samples
-            delay_end = delay_start
-            if min_duration > sample_dur * 2 + 10:
-                logger.info("Extracting end samples...")
-                end_pos = min_duration - sample_dur - 5
+            wav_pairs = [(ref_start, new_start)]
+            if end_pos is not None:
+                logger.info(f"Extracting end samples at {end_pos:.0f}s...")
                 
-                ref_end = self.temp / "ref_end.wav"
-                new_end = self.temp / "new_end.wav"
+                ref_end = work / "ref_end.wav"
+                new_end = work / "new_end.wav"
                 
                 if (self.extract_sample(ref_file, end_pos, sample_dur, ref_end, ref_stream) and
                     self.extract_sample(new_file, end_pos, sample_dur, new_end, new_stream)):
-                    
-                    delay_end_calc = self.correlate(ref_end, new_end)
-                    if delay_end_calc is not None:
-                        delay_end = delay_end_calc
+                    wav_pairs.append((ref_end, new_end))
+            
+            # Calculate start/end delays (in parallel on the pool)
+            delays = self.correlate_many(wav_pairs)
+            delay_start = delays[0]
+            if delay_start is None:
+                raise ValueError("Correlation failed")
             
-            # Calculate drift
+            delay_end = delay_start
+            if len(delays) > 1 and delays[1] is not None:
+                delay_end = delays[1]
+            
+            # Calculate drift, scaled to the classic head-to-tail span so
+            # the atempo formula below stays the same for moved windows
             drift = delay_end - delay_start
+            if end_pos is not None:
+                drift *= (min_duration - sample_dur - 5) / (end_pos - start_pos)
             
             # Atempo calculation
             atempo = None
@@ -358,17 +829,13 @@ class SyncEngine:
                 atempo = duration_calc / (duration_calc - (drift / 1000.0))
                 atempo = round(atempo, 6)
             
-            # Final delay
-            base_delay = int(round(-delay_start))
+            # Final delay (extrapolated back to 0s when drifting)
+            delay_zero = delay_start
+            if atempo and end_pos is not None:
+                delay_zero -= (delay_end - delay_start) * start_pos / (end_pos - start_pos)
+            base_delay = int(round(-delay_zero))
             final_delay = ref_info['internal_delay'] + base_delay
             
-            # Cleanup
-            for f in self.temp.glob('*.wav'):
-                try:
-                    f.unlink()
-                except:
-                    pass
-            
             return {
                 'success': True,
                 'ref_info': ref_info,
@@ -376,14 +843,308 @@ class SyncEngine:
                 'delay_start': delay_start,
                 'delay_end': delay_end,
                 'drift': drift,
+                'window_start': start_pos,
+                'window_end': end_pos,
                 'atempo': atempo,
                 'final_delay': final_delay,
+                'probe_time': probe_time,
                 'processing_time': time.time() - start_time
             }
         
         except Exception as e:
             logger.error(f"Analysis failed: {e}")
             return {'success': False, 'error': str(e)}
+        
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+# ============================================================================
+# JOB QUEUE (Distributed mode)
+# ============================================================================
+
+class JobQueue:
+    """SQLite-backed job queue shared by the bot and analysis workers"""
+    
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    status_msg_id INTEGER,
+                    reference TEXT NOT NULL,
+                    audio TEXT NOT NULL,
+                    batch TEXT,
+                    label TEXT,
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    progress TEXT,
+                    result TEXT,
+                    worker TEXT,
+                    created REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            """)
+            # Databases created before batch support
+            for column in ('batch TEXT', 'label TEXT'):
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Open an autocommit connection (one per call, safe across processes)"""
+        conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+    
+    def _to_job(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['reference'] = json.loads(job['reference'])
+        job['audio'] = json.loads(job['audio'])
+        if job['result']:
+            job['result'] = json.loads(job['result'])
+        return job
+    
+    def _absolute(self, source: Tuple) -> Tuple:
+        """Workers may run from another cwd: store file paths absolute"""
+        if source[0] == 'file':
+            return (source[0], str(Path(source[1]).resolve())) + tuple(source[2:])
+        return tuple(source)
+    
+    def enqueue(self, user_id: int, chat_id: int, status_msg_id: Optional[int],
+                pairs: list, batch: Optional[str] = None) -> list:
+        """Add (label, reference, audio) pairs as jobs in one go, returns their ids"""
+        now = time.time()
+        job_ids = []
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            for label, reference, audio in pairs:
+                cur = conn.execute(
+                    "INSERT INTO jobs (user_id, chat_id, status_msg_id, reference, audio, "
+                    "batch, label, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, chat_id, status_msg_id,
+                     json.dumps(self._absolute(reference)), json.dumps(self._absolute(audio)),
+                     batch, label, now, now)
+                )
+                job_ids.append(cur.lastrowid)
+            conn.execute('COMMIT')
+        return job_ids
+    
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Atomically take the oldest queued (or stale running) job"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE state = 'queued' "
+                    "OR (state = 'running' AND updated < ?) ORDER BY id LIMIT 1",
+                    (now - QUEUE_STALE_AFTER,)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET state = 'running', worker = ?, updated = ? WHERE id = ?",
+                        (worker_id, now, row['id'])
+                    )
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        return self._to_job(row) if row is not None else None
+    
+    def set_progress(self, job_id: int, text: str):
+        """Publish a progress line for the front-end"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, updated = ? WHERE id = ?",
+                (text, time.time(), job_id)
+            )
+    
+    def heartbeat(self, job_id: int, worker_id: str) -> bool:
+        """Keep a running job from being re-claimed; False if we lost it"""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET updated = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                (time.time(), job_id, worker_id)
+            )
+            return cur.rowcount > 0
+    
+    def finish(self, job_id: int, result: Dict, worker_id: str) -> bool:
+        """Store the analysis result (only if worker_id still owns the job)"""
+        state = 'done' if result.get('success') else 'failed'
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET state = ?, result = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND state = 'running'",
+                (state, json.dumps(result, default=str), time.time(), job_id, worker_id)
+            )
+            return cur.rowcount > 0
+    
+    def undelivered(self) -> list:
+        """Jobs whose progress or result the front-end still has to show"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE state != 'delivered' ORDER BY id"
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+    
+    def mark_delivered(self, job_id: int):
+        """Result sent to the user"""
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'delivered', updated = ? WHERE id = ?",
+                (time.time(), job_id)
+            )
+
+
+class AnalysisWorker:
+    """Standalone worker: pulls jobs, downloads and analyzes them"""
+    
+    def __init__(self, queue: JobQueue):
+        self.queue = queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.downloader = DownloadManager()
+        self.pool = AnalysisPool() if ANALYSIS_PROCESSES else None
+        self.engine = SyncEngine(TEMP_DIR / f"worker_{os.getpid()}", self.pool)
+    
+    async def process(self, job: Dict) -> Dict:
+        """Download inputs and run the analysis for one job"""
+        # Per-worker directory: a re-claimed job never shares files
+        job_dir = WORK_DIR / "jobs" / f"{job['id']}_{self.worker_id.replace(':', '_')}"
+        job_dir.mkdir(parents=True, exist_ok=True)
+        
+        try:
+            self.queue.set_progress(job['id'], "📥 Downloading reference...")
+            ref_file = await self.downloader.resolve(job['reference'], job_dir / "reference")
+            if ref_file is None:
+                return {'success': False, 'stage': 'download', 'error': "Reference download failed"}
+            
+            self.queue.set_progress(job['id'], "📥 Downloading audio...")
+            audio_file = await self.downloader.resolve(job['audio'], job_dir / "audio")
+            if audio_file is None:
+                return {'success': False, 'stage': 'download', 'error': "Audio download failed"}
+            
+            self.queue.set_progress(job['id'], "🔬 Analyzing...")
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(
+                None, functools.partial(self.engine.analyze, ref_file, audio_file,
+                                        ref_name=source_name(job['reference']),
+                                        new_name=source_name(job['audio']))
+            )
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+    
+    async def run(self):
+        """Poll the queue forever"""
+        logger.info(f"👷 Worker {self.worker_id} started ({self.queue.db_path})")
+        
+        while True:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                await asyncio.sleep(QUEUE_POLL_INTERVAL)
+                continue
+            
+            logger.info(f"Job #{job['id']} claimed")
+            heartbeat = asyncio.ensure_future(self.heartbeat(job['id']))
+            try:
+                result = await self.process(job)
+            except Exception as e:
+                logger.error(f"Job #{job['id']} error: {e}", exc_info=True)
+                result = {'success': False, 'error': str(e)}
+            finally:
+                heartbeat.cancel()
+            
+            if self.queue.finish(job['id'], result, self.worker_id):
+                logger.info(f"Job #{job['id']} finished (success={result['success']})")
+            else:
+                logger.warning(f"Job #{job['id']} was taken over by another worker, result dropped")
+    
+    async def heartbeat(self, job_id: int):
+        """Touch the job while it runs so it is not considered stale"""
+        while True:
+            await asyncio.sleep(QUEUE_HEARTBEAT)
+            try:
+                if not self.queue.heartbeat(job_id, self.worker_id):
+                    logger.warning(f"Lost ownership of job #{job_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat for job #{job_id} failed: {e}")
+
+# ============================================================================
+# SESSION HELPERS (Multi-pair / season packs)
+# ============================================================================
+
+# Tried in order, first match wins. Bare numbers skip decimals and
+# resolutions ("2.0", "5.1", "1920x1080") and codec/quality tags ("1080p"),
+# but not a number followed by one ("Show.05.720p").
+_BARE_NUMBER = r'(\d{1,3})(?!x\d|\.\d(?!\d{2,3}[pi]\b))(?=v\d|[^A-Za-z0-9]|$)'
+EPISODE_PATTERNS = [
+    r'[Ss]\d{1,2}[ ._-]?[Ee](\d{1,4})',                       # S01E05
+    r'(?<![A-Za-z0-9])\d{1,2}x(\d{2,3})(?![0-9])',            # 1x05
+    r'(?:^|[^A-Za-z])[Ee][Pp]?[ ._-]?(\d{1,4})(?![A-Za-z0-9])',  # E05 / EP05 / ep05_eng
+    r'\s-\s*' + _BARE_NUMBER,                                # "Show - 05"
+    r'(?<![A-Za-z0-9])(?<!\d[.x])' + _BARE_NUMBER,             # "Show 05"
+]
+# Codec tags whose digits look like numbers ("E-AC3", "DDP5.1", "H.264")
+_CODEC_TAGS = (r'(?i)(?<![A-Za-z0-9])(?:E-?AC-?3|AC-?3|DDP?(?:\d\.\d)?|AAC(?:\d\.\d)?'
+               r'|DTS(?:-HD)?|[HX]\.?26[45])(?![A-Za-z0-9])')
+
+
+def source_name(source: Tuple) -> str:
+    """Display name of a ('link', url) or ('file', path, name) entry"""
+    source_type, source_data = source[0], source[1]
+    if source_type == 'link':
+        name = urllib.parse.unquote(urllib.parse.urlparse(source_data).path.rstrip('/').split('/')[-1])
+        return name or source_data
+    # The name as sent; a local Bot API stores uploads under its own names
+    if len(source) > 2 and source[2]:
+        return source[2]
+    return Path(source_data).name
+
+
+def episode_number(name: str) -> Optional[int]:
+    """Best-effort episode number from a file name"""
+    stem = Path(name).stem
+    # "[AAC 2.0]", "(1080p)" etc. are tags; only look inside if nothing else matches
+    untagged = re.sub(r'\[[^\]]*\]|\([^)]*\)', ' ', stem)
+    untagged = re.sub(_CODEC_TAGS, ' ', untagged)
+    for text in (untagged, stem):
+        for pattern in EPISODE_PATTERNS:
+            match = re.search(pattern, text)
+            if match:
+                return int(match.group(1))
+    return None
+
+
+def pair_by_episode(refs: list, audios: list) -> Tuple[Optional[list], Optional[str]]:
+    """
+    Pair two bundles by episode number
+    Returns ([(label, reference, audio), ...], None) or (None, error)
+    """
+    ref_eps = [episode_number(source_name(s)) for s in refs]
+    audio_eps = [episode_number(source_name(s)) for s in audios]
+    
+    # Never guess from upload order: a wrong pair gives a confident wrong delay
+    sources = refs + audios
+    unnumbered = [source_name(s) for s, ep in zip(sources, ref_eps + audio_eps) if ep is None]
+    if unnumbered:
+        return None, ("No episode number in: " + ", ".join(f"`{name}`" for name in unnumbered) +
+                      "\nRename them, or send them as reference/audio pairs without `/bundle`")
+    
+    for kind, eps in (("references", ref_eps), ("audios", audio_eps)):
+        repeated = sorted({ep for ep in eps if eps.count(ep) > 1})
+        if repeated:
+            return None, f"Repeated episodes in {kind}: " + ", ".join(f"E{ep:02d}" for ep in repeated)
+    
+    audio_by_ep = dict(zip(audio_eps, audios))
+    unmatched = sorted(set(ref_eps) ^ set(audio_eps))
+    if unmatched:
+        return None, "Unmatched episodes: " + ", ".join(f"E{ep:02d}" for ep in unmatched)
+    return [(f"E{ep:02d}", ref, audio_by_ep[ep])
+            for ep, ref in sorted(zip(ref_eps, refs), key=lambda item: item[0])], None
 
 # ============================================================================
 # BOT CLASS
@@ -412,8 +1173,13 @@ class MWSAudioSyncBot:
     def __init__(self, token: str):
         self.token = token
         self.downloader = DownloadManager()
-        self.engine = SyncEngine()
+        self.uploader = UploadManager()
+        self.queue = JobQueue(QUEUE_DB) if QUEUE_DB else None
+        # In queue mode analysis happens on the workers, no local pool needed
+        self.pool = AnalysisPool() if ANALYSIS_PROCESSES and not self.queue else None
+        self.engine = SyncEngine(pool=self.pool)
         self.user_data = {}
+        self.syncing = set()
     
     def format_duration(self, seconds: float) -> str:
         """Format duration"""
@@ -447,6 +1213,8 @@ class MWSAudioSyncBot:
             "**WAVEFORM ANALYSIS**",
             f"Delay (Start)  : {result['delay_start']:+.1f} ms",
             f"Delay (End)    : {result['delay_end']:+.1f} ms",
+            f"Windows        : {self.format_duration(result['window_start'])}"
+            + (f" / {self.format_duration(result['window_end'])}" if result['window_end'] is not None else ""),
         ]
         
         if abs(result['drift']) > 100:
@@ -485,7 +1253,7 @@ class MWSAudioSyncBot:
             "",
             f"👤 Req: User",
             f"🔗 Source: {CHANNEL_USERNAME}",
-            f"⏱ Time: {result['processing_time']:.1f}s"
+            f"⏱ Time: {result['processing_time']:.1f}s (probe {result['probe_time']:.1f}s)"
         ])
         
         return "\n".join(report)
@@ -538,6 +1306,7 @@ class MWSAudioSyncBot:
             "├ File upload support\n"
             "├ Precise waveform analysis\n"
             "├ Drift detection & auto-fix\n"
+            "├ Season packs (multi-pair)\n"
             "└ Professional reports\n\n"
             "**📤 Usage:**\n"
             "Send reference video link/file\n"
@@ -565,6 +1334,10 @@ class MWSAudioSyncBot:
                 "Upload video file\n"
                 "Upload audio file\n"
                 "`/sync`\n\n"
+                "**Method 3: Season Packs**\n"
+                "Send ref 1, audio 1, ref 2, audio 2...\n"
+                "or `/bundle`, all refs, `/bundle`, all audios\n"
+                "`/sync`\n\n"
                 "**Supported:**\n"
                 "✅ Direct HTTP links\n"
                 "✅ Google Drive links\n"
@@ -572,6 +1345,7 @@ class MWSAudioSyncBot:
                 "**Commands:**\n"
                 "/start - Welcome\n"
                 "/sync - Analyze\n"
+                "/bundle - Pair by episode number\n"
                 "/clear - Clear data"
             )
         elif query.data == 'about':
@@ -591,143 +1365,462 @@ class MWSAudioSyncBot:
         
         await query.edit_message_text(text, parse_mode='Markdown')
     
+    def get_session(self, user_id: int) -> Dict:
+        """User session: ordered sources plus bundle state"""
+        if user_id not in self.user_data:
+            self.user_data[user_id] = {
+                'items': [], 'bundle': None, 'split': None, 'uploads': []
+            }
+        return self.user_data[user_id]
+    
+    def add_source(self, session: Dict, source: Tuple) -> int:
+        """Fill the first failed upload slot, else append; returns the 1-based slot"""
+        for index, item in enumerate(session['items']):
+            if item[0] == 'failed':
+                session['items'][index] = source
+                return index + 1
+        session['items'].append(source)
+        return len(session['items'])
+    
+    def session_pairs(self, session: Dict) -> Tuple[Optional[list], Optional[str]]:
+        """Resolve a session into [(label, reference, audio), ...]"""
+        items = session['items']
+        
+        for index, item in enumerate(items):
+            if item[0] == 'failed':
+                return None, f"Upload #{index + 1} (`{item[2]}`) failed, {item[3]}"
+        
+        if session['bundle'] is None:
+            if len(items) % 2:
+                return None, f"Reference #{len(items) // 2 + 1} has no audio yet"
+            pairs = []
+            for i in range(0, len(items), 2):
+                ep = episode_number(source_name(items[i]))
+                label = f"E{ep:02d}" if ep is not None else f"#{i // 2 + 1}"
+                pairs.append((label, items[i], items[i + 1]))
+            return pairs, None
+        
+        if session['split'] is None:
+            return None, "Send `/bundle` again, then the audio files"
+        return pair_by_episode(items[:session['split']], items[session['split']:])
+    
+    def received_text(self, session: Dict, kind: str, detail: str,
+                      count: Optional[int] = None) -> str:
+        """Acknowledgement for the count-th link/file (default: latest)"""
+        if count is None:
+            count = len(session['items'])
+        
+        if session['bundle'] == 'refs':
+            return (f"📦 **Reference #{count} Added**\n\n{detail}\n\n"
+                    f"Send more, or `/bundle` to start the audios")
+        if session['bundle'] == 'audio':
+            return (f"📦 **Audio #{count - session['split']} Added**\n\n{detail}\n\n"
+                    f"Send more, or `/sync` to analyze")
+        
+        pair_no = (count + 1) // 2
+        suffix = f" (#{pair_no})" if pair_no > 1 else ""
+        if count % 2:
+            return (f"✅ **Reference {kind} Received{suffix}**\n\n{detail}\n\n"
+                    f"Now send audio link/file")
+        return (f"✅ **Audio {kind} Received{suffix}**\n\n{detail}\n\n"
+                f"Ready! Use `/sync` to analyze\n"
+                f"(or send the next reference)")
+    
     @check_access
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle links and files"""
         user_id = update.effective_user.id
-        
-        if user_id not in self.user_data:
-            self.user_data[user_id] = {}
+        session = self.get_session(user_id)
         
         # Check if it's a link
         if update.message.text and ('http://' in update.message.text or 'https://' in update.message.text):
             link = update.message.text.strip()
-            
-            if 'reference' not in self.user_data[user_id]:
-                self.user_data[user_id]['reference'] = ('link', link)
-                await update.message.reply_text(
-                    f"✅ **Reference Link Received**\n\n"
-                    f"`{link[:60]}...`\n\n"
-                    f"Now send audio link/file"
-                )
-            else:
-                self.user_data[user_id]['audio'] = ('link', link)
-                await update.message.reply_text(
-                    f"✅ **Audio Link Received**\n\n"
-                    f"`{link[:60]}...`\n\n"
-                    f"Ready! Use `/sync` to analyze"
-                )
+            count = self.add_source(session, ('link', link))
+            await update.message.reply_text(
+                self.received_text(session, "Link", f"`{link[:60]}...`", count)
+            )
         
         # Handle document/media files
         elif update.message.document or update.message.video or update.message.audio:
             file_obj = update.message.document or update.message.video or update.message.audio
             
-            # Download file
-            file = await context.bot.get_file(file_obj.file_id)
             user_dir = WORK_DIR / str(user_id)
             user_dir.mkdir(exist_ok=True)
-            
             file_path = user_dir / (file_obj.file_name or f"file_{file_obj.file_id}")
-            await file.download_to_drive(file_path)
             
-            # Determine type
-            if 'reference' not in self.user_data[user_id]:
-                self.user_data[user_id]['reference'] = ('file', file_path)
-                await update.message.reply_text(
-                    f"✅ **Reference File Received**\n\n"
-                    f"Name: `{file_path.name}`\n"
-                    f"Size: {file_obj.file_size / (1024**2):.1f} MB\n\n"
-                    f"Now send audio link/file"
+            # Reserve the slot now so pairing follows send order
+            entry = ('file', file_path, file_obj.file_name or file_path.name)
+            count = self.add_source(session, entry)
+            size_line = f"Name: `{entry[2]}`\nSize: {file_obj.file_size / (1024**2):.1f} MB"
+            
+            message = await update.message.reply_text(
+                self.received_text(session, "File", f"{size_line}\n📥 Receiving...", count)
+            )
+            
+            # Labels are frozen as of now, even if /bundle changes later
+            task = context.application.create_task(
+                self.ingest_upload(context.bot, user_id, session, dict(session), entry,
+                                   file_obj, message, size_line, count)
+            )
+            session['uploads'].append(task)
+    
+    async def ingest_upload(self, bot, user_id: int, session: Dict, view: Dict,
+                            entry: Tuple, file_obj, message, size_line: str, count: int):
+        """Background task: fetch one upload, then update its session slot"""
+        async def progress(done: int, total: int):
+            percent = f"{done * 100 / total:.0f}%" if total else f"{done / (1024**2):.1f} MB"
+            try:
+                await message.edit_text(
+                    self.received_text(view, "File", f"{size_line}\n📥 Receiving... {percent}", count)
                 )
+            except Exception:
+                pass
+        
+        try:
+            file = await bot.get_file(file_obj.file_id)
+            path = await self.uploader.ingest(file, entry[1], progress)
+        except Exception as e:
+            logger.error(f"Upload ingest failed: {redact_token(str(e))}")
+            if self.uploader.is_permanent(e):
+                hint = "send a link to it instead (or `/clear`)"
             else:
-                self.user_data[user_id]['audio'] = ('file', file_path)
-                await update.message.reply_text(
-                    f"✅ **Audio File Received**\n\n"
-                    f"Name: `{file_path.name}`\n"
-                    f"Size: {file_obj.file_size / (1024**2):.1f} MB\n\n"
-                    f"Ready! Use `/sync` to analyze"
+                hint = "send it again"
+            # Keep the slot so later items stay paired; the resend fills it
+            if self.user_data.get(user_id) is session:
+                for index, item in enumerate(session['items']):
+                    if item is entry:
+                        session['items'][index] = ('failed', entry[1], entry[2], hint)
+            try:
+                await message.edit_text(
+                    f"❌ Upload #{count} failed: `{entry[2]}` ({self.uploader.describe_error(e)})\n\n"
+                    f"To fix it, {hint}; it keeps its place"
                 )
+            except Exception:
+                pass
+            return
+        
+        if self.user_data.get(user_id) is session:
+            for i, item in enumerate(session['items']):
+                if item is entry:
+                    session['items'][i] = ('file', path, entry[2])
+        
+        try:
+            await message.edit_text(self.received_text(view, "File", size_line, count))
+        except Exception:
+            pass
+    
+    @check_access
+    async def bundle_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Season packs: collect all references, then all audios"""
+        session = self.get_session(update.effective_user.id)
+        
+        if session['bundle'] is None:
+            if session['items']:
+                await update.message.reply_text("❌ Use `/sync` or `/clear` on the current pairs first")
+                return
+            session['bundle'] = 'refs'
+            await update.message.reply_text(
+                "📦 **Bundle Mode**\n\n"
+                "1️⃣ Send all reference videos (link/file)\n"
+                "2️⃣ `/bundle` again\n"
+                "3️⃣ Send all audios\n"
+                "4️⃣ `/sync`\n\n"
+                "Pairs are matched by episode number"
+            )
+        elif session['bundle'] == 'refs':
+            if not session['items']:
+                await update.message.reply_text("❌ Send at least one reference first")
+                return
+            session['bundle'] = 'audio'
+            session['split'] = len(session['items'])
+            await update.message.reply_text(
+                f"📦 **{session['split']} Reference(s) Collected**\n\n"
+                "Now send all audio links/files, then `/sync`"
+            )
+        else:
+            await update.message.reply_text("📦 Collecting audios. Use `/sync` when done")
+    
+    async def fetch_pair(self, pair: Tuple, user_dir: Path, index: int,
+                         progress=None) -> Tuple[Optional[Tuple[Path, Path]], Optional[str]]:
+        """Resolve one pair to local files"""
+        label, reference, audio = pair
+        
+        if progress and reference[0] == 'link':
+            await progress("📥 Downloading reference...")
+        ref_file = await self.downloader.resolve(reference, user_dir / f"reference_{index}")
+        if ref_file is None:
+            return None, "Reference download failed"
+        
+        if progress and audio[0] == 'link':
+            await progress("📥 Downloading audio...")
+        audio_file = await self.downloader.resolve(audio, user_dir / f"audio_{index}")
+        if audio_file is None:
+            return None, "Audio download failed"
+        
+        return (ref_file, audio_file), None
+    
+    async def run_pairs(self, pairs: list, user_dir: Path, progress) -> list:
+        """
+        Pipeline: pair N+1 downloads while pair N is analyzed
+        Returns [(label, name, result), ...]
+        """
+        loop = asyncio.get_event_loop()
+        entries = []
+        
+        pending = asyncio.ensure_future(self.fetch_pair(pairs[0], user_dir, 0, progress))
+        try:
+            for i, pair in enumerate(pairs):
+                label, reference, audio = pair
+                files, error = await pending
+                if i + 1 < len(pairs):
+                    pending = asyncio.ensure_future(self.fetch_pair(pairs[i + 1], user_dir, i + 1))
+                
+                if files is None:
+                    result = {'success': False, 'stage': 'download', 'error': error}
+                else:
+                    if len(pairs) > 1:
+                        await progress(f"🔬 Analyzing {label} ({i + 1}/{len(pairs)})...")
+                    else:
+                        await progress("🔬 Analyzing...")
+                    result = await loop.run_in_executor(
+                        None, functools.partial(self.engine.analyze, files[0], files[1],
+                                                ref_name=source_name(reference),
+                                                new_name=source_name(audio))
+                    )
+                    # Downloaded (not uploaded) inputs are no longer needed
+                    for source, path in ((reference, files[0]), (audio, files[1])):
+                        if source[0] == 'link' and len(pairs) > 1:
+                            path.unlink(missing_ok=True)
+                
+                entries.append((label, source_name(reference), result))
+        finally:
+            pending.cancel()
+        
+        return entries
+    
+    def failure_text(self, result: Dict) -> str:
+        if result.get('stage') == 'download':
+            return f"❌ {result['error']}"
+        return f"❌ Analysis failed: {result['error']}"
+    
+    def generate_summary(self, entries: list) -> str:
+        """Combined report for multi-pair sessions"""
+        lines = [
+            "**BATCH SYNC SUMMARY**",
+            "━━━━━━━━━━━━━━━━━━━━━━━━",
+        ]
+        
+        total_time = 0.0
+        for label, name, result in entries:
+            short = f"{name[:40]}{'...' if len(name) > 40 else ''}"
+            if not result['success']:
+                lines.append(f"❌ {label} · `{short}`")
+                lines.append(f"   └─ {result['error']}")
+                continue
+            
+            total_time += result['processing_time']
+            if result['atempo']:
+                lines.append(f"🚨 {label} · `{short}`")
+                lines.append(f"   └─ atempo={result['atempo']} + Delay {result['final_delay']} ms")
+            else:
+                lines.append(f"✅ {label} · `{short}`")
+                lines.append(f"   └─ Delay {result['final_delay']} ms")
+        
+        synced = sum(1 for _, _, result in entries if result['success'])
+        lines.extend([
+            "━━━━━━━━━━━━━━━━━━━━━━━━",
+            "",
+            f"📊 Synced: {synced}/{len(entries)}",
+            f"🔗 Source: {CHANNEL_USERNAME}",
+            f"⏱ Time: {total_time:.1f}s"
+        ])
+        
+        return "\n".join(lines)
+    
+    async def send_results(self, bot, chat_id: int, entries: list,
+                           status_msg_id: Optional[int] = None):
+        """Single pair: full report + commands; several: one summary"""
+        if any(result['success'] for _, _, result in entries) and status_msg_id:
+            try:
+                await bot.delete_message(chat_id, status_msg_id)
+            except Exception:
+                pass
+        
+        if len(entries) > 1:
+            await bot.send_message(chat_id, self.generate_summary(entries), parse_mode='Markdown')
+            return
+        
+        result = entries[0][2]
+        if not result['success']:
+            await bot.send_message(chat_id, self.failure_text(result))
+            return
+        
+        await bot.send_message(chat_id, self.generate_report(result), parse_mode='Markdown')
+        await bot.send_message(chat_id, self.generate_commands(result), parse_mode='Markdown')
     
     @check_access
     async def sync_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Main sync command"""
         user_id = update.effective_user.id
+        session = self.get_session(user_id)
+        
+        # Tracked per user, not per session: the session is detached once
+        # processing starts
+        if user_id in self.syncing:
+            await update.message.reply_text("⏳ A sync is already running for you")
+            return
+        
+        # Run in the background: updates are handled one at a time, so a
+        # season pack must not stall the bot for everyone else
+        self.syncing.add(user_id)
+        context.application.create_task(self.run_sync(update, context, session))
+    
+    async def run_sync(self, update: Update, context: ContextTypes.DEFAULT_TYPE, session: Dict):
+        """Background task behind /sync"""
+        try:
+            await self._run_sync(update, context, session)
+        finally:
+            self.syncing.discard(update.effective_user.id)
+    
+    async def _run_sync(self, update: Update, context: ContextTypes.DEFAULT_TYPE, session: Dict):
+        user_id = update.effective_user.id
+        
+        # Uploads still streaming in the background (more may arrive meanwhile)
+        pending = [task for task in session['uploads'] if not task.done()]
+        if pending:
+            waiting = await update.message.reply_text(f"⏳ Waiting for {len(pending)} upload(s)...")
+            while pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+                pending = [task for task in session['uploads'] if not task.done()]
+            await waiting.delete()
+        session['uploads'] = []
         
-        if user_id not in self.user_data or len(self.user_data[user_id]) < 2:
+        pairs, error = self.session_pairs(session)
+        if not pairs:
             await update.message.reply_text(
                 "❌ **Missing Data**\n\n"
+                + (f"{error}\n\n" if error else "") +
                 "Send:\n"
                 "1️⃣ Reference video (link/file)\n"
-                "2️⃣ New audio (link/file)\n\n"
+                "2️⃣ New audio (link/file)\n"
+                "(repeat for more episodes, or use `/bundle`)\n\n"
                 "Then use `/sync`"
             )
             return
         
         status = await update.message.reply_text(
             "⏳ **Processing Started**\n\n"
+            + (f"├ {len(pairs)} pairs\n" if len(pairs) > 1 else "") +
             "├ Preparing...\n"
             "└ Please wait..."
         )
         
-        try:
-            user_dir = WORK_DIR / str(user_id)
-            user_dir.mkdir(exist_ok=True)
-            
-            ref_type, ref_data = self.user_data[user_id]['reference']
-            audio_type, audio_data = self.user_data[user_id]['audio']
-            
-            # Download if links
-            if ref_type == 'link':
-                await status.edit_text("📥 Downloading reference...")
-                ref_file = user_dir / "reference"
-                if not await self.downloader.download(ref_data, ref_file):
-                    await update.message.reply_text("❌ Reference download failed")
-                    return
-            else:
-                ref_file = ref_data
-            
-            if audio_type == 'link':
-                await status.edit_text("📥 Downloading audio...")
-                audio_file = user_dir / "audio"
-                if not await self.downloader.download(audio_data, audio_file):
-                    await update.message.reply_text("❌ Audio download failed")
-                    return
-            else:
-                audio_file = audio_data
-            
-            # Analyze
-            await status.edit_text("🔬 Analyzing...")
-            
-            loop = asyncio.get_event_loop()
-            result = await loop.run_in_executor(
-                None, self.engine.analyze, ref_file, audio_file
+        # Detach: anything sent from now on starts a new session
+        if self.user_data.get(user_id) is session:
+            del self.user_data[user_id]
+        
+        # Distributed mode: hand off to the workers
+        if self.queue:
+            job_ids = self.queue.enqueue(
+                user_id, update.effective_chat.id, status.message_id, pairs,
+                batch=f"{update.effective_chat.id}:{status.message_id}" if len(pairs) > 1 else None
             )
+            await status.edit_text(
+                f"📋 **Queued** (job{'s' if len(job_ids) > 1 else ''} "
+                f"#{', #'.join(str(job_id) for job_id in job_ids)})\n\n"
+                "└ A worker will pick it up shortly..."
+            )
+            return
+        
+        user_dir = WORK_DIR / str(user_id)
+        user_dir.mkdir(exist_ok=True)
+        # Private download dir for this sync only
+        sync_dir = Path(tempfile.mkdtemp(dir=user_dir, prefix="sync_"))
+        
+        try:
+            entries = await self.run_pairs(pairs, sync_dir, status.edit_text)
+            await self.send_results(context.bot, update.effective_chat.id, entries, status.message_id)
             
-            if not result['success']:
-                await update.message.reply_text(f"❌ Analysis failed: {result['error']}")
-                return
-            
-            # Send results
-            report = self.generate_report(result)
-            commands = self.generate_commands(result)
-            
-            await status.delete()
-            await update.message.reply_text(report, parse_mode='Markdown')
-            await update.message.reply_text(commands, parse_mode='Markdown')
-            
-            # Cleanup
-            del self.user_data[user_id]
+            # Keep the session for a retry if nothing worked
+            if not any(result['success'] for _, _, result in entries):
+                self.user_data.setdefault(user_id, session)
         
         except Exception as e:
             logger.error(f"Sync error: {e}", exc_info=True)
+            self.user_data.setdefault(user_id, session)
             await status.edit_text(f"❌ Error: {str(e)}")
+        
+        finally:
+            shutil.rmtree(sync_dir, ignore_errors=True)
+    
+    async def queue_delivery_loop(self, app: Application):
+        """Stream worker progress and results back to users"""
+        shown = {}
+        
+        while True:
+            await asyncio.sleep(QUEUE_POLL_INTERVAL)
+            try:
+                # Group jobs of one multi-pair /sync together
+                groups = {}
+                for job in self.queue.undelivered():
+                    groups.setdefault(job['batch'] or f"job:{job['id']}", []).append(job)
+                
+                for key, group in groups.items():
+                    head = group[0]
+                    finished = [job for job in group if job['state'] in ('done', 'failed')]
+                    
+                    if len(finished) < len(group):
+                        running = [job for job in group if job['state'] == 'running' and job['progress']]
+                        if len(group) == 1:
+                            text = running[0]['progress'] if running else None
+                        else:
+                            text = f"⏳ Batch: {len(finished)}/{len(group)} done"
+                            for job in running:
+                                text += f"\n├ {job['label']}: {job['progress']}"
+                        
+                        if text and head['status_msg_id'] and shown.get(key) != text:
+                            shown[key] = text
+                            try:
+                                await app.bot.edit_message_text(
+                                    text, chat_id=head['chat_id'],
+                                    message_id=head['status_msg_id']
+                                )
+                            except Exception:
+                                pass
+                        continue
+                    
+                    entries = [
+                        (job['label'] or f"#{job['id']}", source_name(job['reference']),
+                         job['result'] or {'success': False, 'error': 'No result'})
+                        for job in group
+                    ]
+                    try:
+                        await self.send_results(app.bot, head['chat_id'], entries, head['status_msg_id'])
+                    except Exception as e:
+                        logger.error(f"Delivery of {key} failed: {e}")
+                    for job in group:
+                        self.queue.mark_delivered(job['id'])
+                    shown.pop(key, None)
+            except Exception as e:
+                logger.error(f"Queue delivery error: {e}")
+    
+    async def post_init(self, app: Application):
+        """Start background tasks once the application is up"""
+        if self.queue:
+            app.create_task(self.queue_delivery_loop(app))
     
     @check_access
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Clear user data"""
         user_id = update.effective_user.id
         
+        if user_id in self.syncing:
+            await update.message.reply_text("⏳ A sync is running, use /clear when it finishes")
+            return
+        
         if user_id in self.user_data:
+            for task in self.user_data[user_id]['uploads']:
+                task.cancel()
             del self.user_data[user_id]
         
         user_dir = WORK_DIR / str(user_id)
@@ -751,10 +1844,16 @@ class MWSAudioSyncBot:
     
     def run(self):
         """Start bot"""
-        app = Application.builder().token(self.token).build()
+        builder = Application.builder().token(self.token).post_init(self.post_init)
+        if LOCAL_BOT_API:
+            builder = (builder.base_url(f"{LOCAL_BOT_API}/bot")
+                       .base_file_url(f"{LOCAL_BOT_API}/file/bot")
+                       .local_mode(True))
+        app = builder.build()
         
         app.add_handler(CommandHandler("start", self.start_command))
         app.add_handler(CommandHandler("sync", self.sync_command))
+        app.add_handler(CommandHandler("bundle", self.bundle_command))
         app.add_handler(CommandHandler("clear", self.clear_command))
         app.add_handler(CommandHandler("adduser", self.adduser_command))
         app.add_handler(CallbackQueryHandler(self.callback_handler))
@@ -766,11 +1865,26 @@ class MWSAudioSyncBot:
         logger.info("🎬 MWS - Audio Sync Bot Started!")
         logger.info(f"Channel: {CHANNEL_USERNAME}")
         logger.info(f"Allowed: {ALLOWED_USERS}")
+        if self.queue:
+            logger.info(f"Queue mode: {self.queue.db_path}")
+        if LOCAL_BOT_API:
+            logger.info(f"Local Bot API: {LOCAL_BOT_API}")
         
-        app.run_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            app.run_polling(allowed_updates=Update.ALL_TYPES)
+        finally:
+            if self.pool:
+                self.pool.shutdown()
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        if not QUEUE_DB:
+            print("❌ Set QUEUE_DB in bot.py to run workers")
+            sys.exit(1)
+        asyncio.run(AnalysisWorker(JobQueue(QUEUE_DB)).run())
+        sys.exit(0)
+    
     print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")
     print("🎬 MWS - AUDIO SYNC BOT v1.0")
     print("━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━")